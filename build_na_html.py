@@ -1,9 +1,25 @@
+import hashlib
 import json
 import re
+import shelve
+import threading
+import time
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
+from zoneinfo import ZoneInfo
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен — работаем на стандартном json
+    orjson = None
 
 API_BASE = "https://na-russia.org/api"
 SITE_BASE = "https://na-russia.org"
@@ -17,15 +33,88 @@ CITIES_URLS = [
 # Локальный кэш cities.json
 CITIES_CACHE_FILE = Path("cities.json")
 
+# ETag последнего ответа API с городами (для условного запроса If-None-Match)
+CITIES_ETAG_FILE = Path("cities.etag")
+
+# Хэш сырого ответа API, из которого последний раз записан cities.json
+CITIES_HASH_FILE = Path("cities.hash")
+
+# Кэш встреч между запусками (shelve): { "town_id:дата": {"ts": ..., "data": [...]} }
+MEETINGS_CACHE_FILE = Path("meetings_cache.db")
+
+# Сколько секунд запись кэша встреч считается свежей
+MEETINGS_CACHE_TTL = 600
+
 # Можно задать конкретную дату "ГГГГ-ММ-ДД". Если None — берётся сегодня.
 CUSTOM_DATE = None
 
-# Смещение Московского времени относительно UTC (Россия сейчас постоянно UTC+3)
-MOSCOW_OFFSET = timedelta(hours=3)
+# Часовой пояс, по которому определяем "сегодня"
+MOSCOW_TZ = ZoneInfo("Europe/Moscow")
 
 # Печатать ли список первых городов (для проверки)
 PRINT_CITIES = True
 
+# Сколько городов опрашиваем параллельно. Столько же keep-alive соединений
+# к API держит сессия — больше этого числа соединений к сайту не открываем.
+MAX_WORKERS = 20
+
+# Общая HTTP-сессия: keep-alive соединения к API вместо нового TCP+TLS на каждый запрос.
+# Сжатие запрашиваем явно; ACCEPT_ENCODING из urllib3 содержит только те кодировки,
+# которые он сможет распаковать ("br" — если установлен пакет brotli).
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "na-html-builder/1.0", "Accept-Encoding": ACCEPT_ENCODING})
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=MAX_WORKERS,
+        pool_block=True,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+    ),
+)
+
+# Открытый кэш встреч (None — кэш не используется) и блокировка к нему:
+# shelve не потокобезопасен, а встречи загружаются из нескольких потоков
+MEETINGS_CACHE = None
+_MEETINGS_CACHE_LOCK = threading.Lock()
+
+# Каркас итогового HTML
+HTML_HEADER = (
+    '<section class="na-meetings">\n'
+    "  <h1>Живые группы АН (РФ, на {on_date})</h1>\n"
+    "\n"
+)
+HTML_FOOTER = "</section>"
+
+# Блоки внутри раздела города
+LIST_OPEN = "  <ul>\n"
+LIST_CLOSE = "  </ul>\n\n"
+EXTERNAL_SITE_TEMPLATE = (
+    "  <p>Город {name} имеет отдельный сайт, на котором вы можете посмотреть расписание собраний. "
+    '<a href="{url}" target="_blank" rel="noopener noreferrer">Перейти на сайт</a></p>\n'
+    "\n"
+)
+GROUP_LINK_TEMPLATE = (
+    '<a href="{url}" target="_blank" rel="noopener noreferrer">сайт группы</a><br>'
+)
+
+# Название города в адресе: 'г. Балашов, ...' или 'г.Балашов, ...'
+_CITY_RE = re.compile(r"г\.\s*([А-ЯA-ZЁ][^,]+)")
+
+
+def _json_loads(data):
+    """Разбираем JSON из bytes (через orjson, если он доступен)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(payload):
+    """Сериализуем в bytes с отступом 2 и без экранирования кириллицы."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+
 
 def _parse_cities_payload(payload):
     """
@@ -54,6 +143,37 @@ def _parse_cities_payload(payload):
     return towns, regions
 
 
+def _save_cities_cache(payload, raw, etag):
+    """
+    Обновляем локальный кэш cities.json "как есть".
+    Файл переписываем, только если содержимое действительно изменилось.
+    Если сырой ответ API совпадает по хэшу с прошлым, не сериализуем payload
+    и не перечитываем сам cities.json.
+    ETag ответа сохраняем рядом, чтобы в следующий раз спросить API условно.
+    """
+    digest = hashlib.blake2b(raw).hexdigest()
+
+    if (
+        CITIES_CACHE_FILE.exists()
+        and CITIES_HASH_FILE.exists()
+        and CITIES_HASH_FILE.read_text(encoding="utf-8").strip() == digest
+    ):
+        print(f"[CACHE] Локальный файл {CITIES_CACHE_FILE} не изменился")
+    else:
+        data = _json_dumps(payload)
+        if CITIES_CACHE_FILE.exists() and CITIES_CACHE_FILE.read_bytes() == data:
+            print(f"[CACHE] Локальный файл {CITIES_CACHE_FILE} не изменился")
+        else:
+            CITIES_CACHE_FILE.write_bytes(data)
+            print(f"[CACHE] Локальный файл {CITIES_CACHE_FILE} обновлён")
+        CITIES_HASH_FILE.write_text(digest, encoding="utf-8")
+
+    if etag:
+        CITIES_ETAG_FILE.write_text(etag, encoding="utf-8")
+    elif CITIES_ETAG_FILE.exists():
+        CITIES_ETAG_FILE.unlink()
+
+
 def load_cities():
     """
     1. Пытаемся получить список городов с API (/api/bff/cities)
@@ -65,20 +185,26 @@ def load_cities():
     last_error = None
     payload = None
 
+    # Если локальный кэш есть, спрашиваем API условно: при неизменном списке
+    # сервер ответит 304 без тела, и мы возьмём города из cities.json
+    headers = {}
+    if CITIES_CACHE_FILE.exists() and CITIES_ETAG_FILE.exists():
+        etag = CITIES_ETAG_FILE.read_text(encoding="utf-8").strip()
+        if etag:
+            headers["If-None-Match"] = etag
+
     # 1. Пробуем API
     for url in CITIES_URLS:
         try:
-            resp = requests.get(url, timeout=20)
+            resp = SESSION.get(url, headers=headers, timeout=20)
+            if resp.status_code == 304:
+                print(f"[API] Список городов на {url} не изменился (304)")
+                break
             if resp.status_code == 200:
-                payload = resp.json()
+                payload = _json_loads(resp.content)
                 print(f"[API] Города загружены с {url}")
-                # Обновляем локальный кэш "как есть"
                 try:
-                    CITIES_CACHE_FILE.write_text(
-                        json.dumps(payload, ensure_ascii=False, indent=2),
-                        encoding="utf-8",
-                    )
-                    print(f"[CACHE] Локальный файл {CITIES_CACHE_FILE} обновлён")
+                    _save_cities_cache(payload, resp.content, resp.headers.get("ETag"))
                 except Exception as e:
                     print(f"[WARN] Не удалось обновить кэш {CITIES_CACHE_FILE}: {e}")
                 break
@@ -88,12 +214,12 @@ def load_cities():
             last_error = e
             print(f"[WARN] Ошибка при запросе {url}: {e}")
 
-    # 2. Если с API не получилось — пробуем локальный файл
+    # 2. Если с API не получилось (или список не изменился) — берём локальный файл
     if payload is None:
         if CITIES_CACHE_FILE.exists():
             print(f"[LOCAL] Загружаю города из локального файла {CITIES_CACHE_FILE}")
             try:
-                payload = json.loads(CITIES_CACHE_FILE.read_text(encoding="utf-8"))
+                payload = _json_loads(CITIES_CACHE_FILE.read_bytes())
             except Exception as e:
                 raise RuntimeError(
                     f"Не удалось прочитать {CITIES_CACHE_FILE}: {e}"
@@ -108,32 +234,67 @@ def load_cities():
     if not towns:
         raise RuntimeError("В данных городов (towns) не найдено вообще ничего.")
 
-    # Строим карту регионов по id, чтобы отфильтровать только РФ
-    region_by_id = {}
-    for r in regions:
-        rid = r.get("id")
-        if rid is not None:
-            region_by_id[rid] = r
-
-    if region_by_id:
-        towns_ru = []
-        for t in towns:
-            reg_id = t.get("geographic_region")
-            if reg_id is None:
-                continue
-            region = region_by_id.get(reg_id)
-            if not region:
-                continue
-            if region.get("country") == 1:
-                towns_ru.append(t)
-        towns = towns_ru
+    # Собираем id регионов РФ один раз — дальше фильтр по городам это одна проверка в set
+    if regions:
+        ru_region_ids = {
+            r["id"] for r in regions if r.get("country") == 1 and r.get("id") is not None
+        }
+        towns = [t for t in towns if t.get("geographic_region") in ru_region_ids]
 
     print(f"[INFO] Всего городов РФ найдено: {len(towns)}")
     return towns
 
 
-def get_meetings_for_town(town_id, on_date):
-    """Берём все встречи для одного города на указанную дату."""
+def _open_meetings_cache():
+    """
+    Открываем кэш встреч и сразу выкидываем из него просроченные записи,
+    чтобы файл не разрастался от запуска к запуску.
+    Если кэш открыть не удалось — работаем без него.
+    """
+    try:
+        cache = shelve.open(str(MEETINGS_CACHE_FILE))
+    except Exception as e:
+        print(f"[WARN] Не удалось открыть кэш встреч {MEETINGS_CACHE_FILE}: {e}")
+        return None
+
+    now = time.time()
+    for key in list(cache.keys()):
+        try:
+            expired = now - cache[key]["ts"] >= MEETINGS_CACHE_TTL
+        except Exception:
+            expired = True
+        if expired:
+            del cache[key]
+
+    return cache
+
+
+def get_meetings_for_town(town_id, on_date, ttl=MEETINGS_CACHE_TTL):
+    """
+    Встречи города на дату с кэшем между запусками:
+    если в MEETINGS_CACHE есть запись моложе ttl секунд — в API не ходим.
+    """
+    if MEETINGS_CACHE is None:
+        return _fetch_meetings_for_town(town_id, on_date)
+
+    key = f"{town_id}:{on_date}"
+    with _MEETINGS_CACHE_LOCK:
+        entry = MEETINGS_CACHE.get(key)
+    if entry and time.time() - entry["ts"] < ttl:
+        return entry["data"]
+
+    data = _fetch_meetings_for_town(town_id, on_date)
+    with _MEETINGS_CACHE_LOCK:
+        MEETINGS_CACHE[key] = {"ts": time.time(), "data": data}
+    return data
+
+
+def _fetch_meetings_for_town(town_id, on_date):
+    """
+    Берём живые встречи (online == False) для одного города на указанную дату.
+    Онлайн-встречи отбрасываем сразу при разборе каждой страницы,
+    чтобы не копить в памяти то, что в HTML всё равно не попадёт.
+    """
     url = f"{API_BASE}/scheduled-meetings/merged/"
     params = {
         "town": town_id,
@@ -146,11 +307,11 @@ def get_meetings_for_town(town_id, on_date):
     all_results = []
 
     while url:
-        resp = requests.get(url, params=params, timeout=20)
+        resp = SESSION.get(url, params=params, timeout=20)
         resp.raise_for_status()
-        data = resp.json()
+        data = _json_loads(resp.content)
 
-        all_results.extend(data.get("results", []))
+        all_results.extend(m for m in data.get("results", []) if not m.get("online"))
 
         next_url = data.get("next")
         if next_url:
@@ -166,7 +327,9 @@ def get_meetings_for_town(town_id, on_date):
 def build_data(on_date):
     """
     1) Получаем список городов РФ
-    2) Для каждого – тянем встречи (кроме городов с внешним сайтом)
+    2) Тянем встречи (кроме городов с внешним сайтом). Спутник, чей общий
+       город (general_town) запрашивается как корневой, отдельного запроса
+       не получает — его встречи приходят в ответе общего города
     3) Возвращаем:
        - meetings_by_town: { town_id: [meeting, ...] }
        - cities_by_id: { town_id: town_obj }
@@ -174,8 +337,11 @@ def build_data(on_date):
     """
     cities = load_cities()
 
+    # За один проход раскладываем города: карта по id, внешние сайты
+    # и список городов, для которых нужно тянуть встречи
     cities_by_id = {}
     external_sites = {}
+    to_fetch = []
 
     for c in cities:
         cid = c.get("id")
@@ -186,6 +352,8 @@ def build_data(on_date):
         ext_url = c.get("redirect_url") or c.get("separate_site_url")
         if ext_url:
             external_sites[cid] = ext_url
+        else:
+            to_fetch.append(c)
 
     if PRINT_CITIES:
         print("Первые несколько городов РФ:")
@@ -195,51 +363,78 @@ def build_data(on_date):
 
     print(f"[INFO] Городов с внешними сайтами: {len(external_sites)}")
 
+    # Запрос с include_child_towns=true уже возвращает встречи городов-спутников,
+    # поэтому спутник отдельно не запрашиваем, если его общий город (general_town)
+    # сам запрашивается как корневой. Раскладка по location.town_id ниже
+    # всё равно вернёт встречи в нужный город.
+    fetch_ids = {c["id"] for c in to_fetch}
+    root_ids = {c["id"] for c in to_fetch if c.get("general_town") not in fetch_ids}
+    # Спутники, чьи встречи придут вместе с общим городом: { id общего города: [город, ...] }
+    covered_by_root = {}
+    fetch_list = []
+    for c in to_fetch:
+        parent_id = c.get("general_town")
+        if c["id"] not in root_ids and parent_id in root_ids:
+            covered_by_root.setdefault(parent_id, []).append(c)
+        else:
+            fetch_list.append(c)
+    to_fetch = fetch_list
+    print(
+        f"[INFO] Загружаю встречи для {len(to_fetch)} городов "
+        f"(спутники без отдельного запроса: {len(fetch_ids) - len(to_fetch)})"
+    )
+
     meetings_by_town = {}
+    mbt_setdefault = meetings_by_town.setdefault
 
-    for c in cities:
-        town_id = c.get("id")
-        town_name = c.get("name", f"Город id={town_id}")
+    # Запросы к API независимы — отправляем их параллельно через общую сессию
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = [
+            pool.submit(get_meetings_for_town, c.get("id"), on_date) for c in to_fetch
+        ]
 
-        # Если у города есть внешний сайт — не тянем для него встречи
-        if town_id in external_sites:
-            print(
-                f"\nПропускаю загрузку встреч для {town_name} (id={town_id}), есть внешний сайт."
-            )
-            continue
+        # Результаты разбираем в исходном порядке городов,
+        # чтобы итоговый HTML не зависел от порядка ответов
+        for c, future in zip(to_fetch, futures):
+            town_id = c.get("id")
+            town_name = c.get("name", f"Город id={town_id}")
 
-        print(f"\nСобираю встречи для: {town_name} (id={town_id})")
-        try:
-            meetings = get_meetings_for_town(town_id, on_date)
-        except Exception as e:
-            print(f"  Ошибка для {town_name}: {e}")
-            continue
-
-        # Оставляем только живые (online == False)
-        meetings = [m for m in meetings if not m.get("online")]
+            print(f"\nСобираю встречи для: {town_name} (id={town_id})")
+            try:
+                meetings = future.result()
+            except Exception as e:
+                print(f"  Ошибка для {town_name}: {e}")
+                covered = covered_by_root.get(town_id)
+                if covered:
+                    names = ", ".join(
+                        s.get("name", f"Город id={s['id']}") for s in covered
+                    )
+                    print(f"  Встречи спутников тоже не загружены: {names}")
+                continue
 
-        if not meetings:
-            print("  Живых встреч на эту дату нет")
-            continue
+            if not meetings:
+                print("  Живых встреч на эту дату нет")
+                continue
 
-        # раскладываем по фактическому town_id из location
-        for m in meetings:
-            group = m.get("group", {})
-            loc = group.get("location", {})
-            real_town_id = loc.get("town_id", town_id)
-            meetings_by_town.setdefault(real_town_id, []).append(m)
+            # раскладываем по фактическому town_id из location
+            for m in meetings:
+                group = m.get("group") or {}
+                loc = group.get("location") or {}
+                mbt_setdefault(loc.get("town_id", town_id), []).append(m)
 
     return meetings_by_town, cities_by_id, external_sites
 
 
+@lru_cache(maxsize=1024)
 def guess_city_name_from_address(address):
     """
     Пытаемся вытащить название города из строки адреса.
     Ищем шаблон вида 'г. Балашов, ...' или 'г.Балашов, ...'.
+    Результат кэшируется: у встреч одного города адреса часто совпадают.
     """
     if not address:
         return None
-    m = re.search(r"г\.\s*([А-ЯA-ZЁ][^,]+)", address)
+    m = _CITY_RE.search(address)
     if m:
         return m.group(1).strip()
     return None
@@ -251,12 +446,13 @@ def deduplicate_meetings(meetings):
     (id группы, время, длительность, адрес).
     Оставляем первую запись с таким ключом.
     """
-    seen = set()
-    unique = []
+    unique = {}
+    # setdefault не перезаписывает уже сохранённую встречу — остаётся первая
+    keep_first = unique.setdefault
 
     for m in meetings:
-        g = m.get("group", {})
-        loc = g.get("location", {})
+        g = m.get("group") or {}
+        loc = g.get("location") or {}
 
         key = (
             g.get("id"),
@@ -265,144 +461,142 @@ def deduplicate_meetings(meetings):
             loc.get("address"),
         )
 
-        if key in seen:
-            continue
+        keep_first(key, m)
 
-        seen.add(key)
-        unique.append(m)
+    return list(unique.values())
 
-    return unique
 
+def build_html_iter(on_date, meetings_by_town, cities_by_id, external_sites):
+    """
+    Генерируем HTML построчно (каждая строка уже с переводом строки),
+    чтобы его можно было писать в файл потоком, не собирая целиком в памяти.
+    """
+    yield HTML_HEADER.format_map({"on_date": on_date})
 
-def build_html(on_date, meetings_by_town, cities_by_id, external_sites):
-    lines = []
-    lines.append('<section class="na-meetings">')
-    lines.append(f"  <h1>Живые группы АН (РФ, на {on_date})</h1>")
-    lines.append("")
+    # Поиск города по id нужен в каждом цикле ниже
+    get_city = cities_by_id.get
 
     # Все города, которые надо показать: с встречами ИЛИ с внешним сайтом
     all_town_ids = set(meetings_by_town.keys()) | set(external_sites.keys())
 
-    # Сортируем города по имени
-    def town_sort_key(town_id):
-        city_obj = cities_by_id.get(town_id, {})
-        if isinstance(city_obj, dict):
-            name = city_obj.get("name")
-        else:
-            name = None
-        return name or f"Город id={town_id}"
-
-    for town_id in sorted(all_town_ids, key=town_sort_key):
-        city_obj = cities_by_id.get(town_id, {})
-        if isinstance(city_obj, dict):
-            city_name = city_obj.get("name")
-        else:
-            city_name = None
+    # Имена городов считаем один раз: они нужны и для сортировки, и для заголовков
+    name_by_id = {}
+    unnamed_ids = set()
+    for tid in all_town_ids:
+        city_obj = get_city(tid)
+        name = city_obj.get("name") if isinstance(city_obj, dict) else None
+        if not name:
+            name = f"Город id={tid}"
+            unnamed_ids.add(tid)
+        name_by_id[tid] = name
 
+    # Сортируем города по имени
+    for town_id in sorted(all_town_ids, key=name_by_id.__getitem__):
+        city_name = name_by_id[town_id]
         meetings = meetings_by_town.get(town_id, [])
 
         # Если имя города отсутствует — пробуем угадать по адресу первой встречи
-        if not city_name and meetings:
+        if town_id in unnamed_ids and meetings:
             first = meetings[0]
-            group = first.get("group", {})
-            loc = group.get("location", {})
-            addr = loc.get("address", "")
+            group = first.get("group") or {}
+            loc = group.get("location") or {}
+            addr = loc.get("address") or ""
             guessed = guess_city_name_from_address(addr)
             if guessed:
                 city_name = guessed
+                city_obj = get_city(town_id)
                 if isinstance(city_obj, dict):
                     city_obj["name"] = guessed
-                    cities_by_id[town_id] = city_obj
                 else:
                     cities_by_id[town_id] = {"id": town_id, "name": guessed}
-            else:
-                city_name = f"Город id={town_id}"
 
-        if not city_name:
-            city_name = f"Город id={town_id}"
-
-        lines.append(f"  <h2>{city_name}</h2>")
+        yield f"  <h2>{escape(city_name)}</h2>\n"
 
         ext_url = external_sites.get(town_id)
 
         if ext_url:
             # Город с отдельным сайтом — показываем заглушку и ссылку
-            lines.append(
-                f'  <p>Город {city_name} имеет отдельный сайт, на котором вы можете посмотреть расписание собраний. '
-                f'<a href="{ext_url}" target="_blank" rel="noopener noreferrer">Перейти на сайт</a></p>'
+            yield EXTERNAL_SITE_TEMPLATE.format(
+                name=escape(city_name), url=escape(ext_url, quote=True)
             )
-            lines.append("")
             continue
 
         # Обычный город: выводим список встреч
         meetings = deduplicate_meetings(meetings)
-        lines.append("  <ul>")
+        yield LIST_OPEN
 
         meetings_sorted = sorted(meetings, key=lambda m: (m.get("time") or ""))
 
         for m in meetings_sorted:
-            group = m.get("group", {})
-            loc = group.get("location", {})
+            group = m.get("group") or {}
+            loc = group.get("location") or {}
 
-            group_name = group.get("name", "Без названия")
-            addr = loc.get("address", "Адрес не указан")
-            time = (m.get("time") or "")[:5]
+            group_name = group.get("name") or "Без названия"
+            addr = loc.get("address") or "Адрес не указан"
+            start_time = (m.get("time") or "")[:5]
             duration = (m.get("duration") or "")[:5]
 
             # Строим URL страницы группы, если возможно
             group_id = group.get("id")
             real_town_id = loc.get("town_id", town_id)
-            city_obj_for_group = cities_by_id.get(real_town_id, {})
+            city_obj_for_group = get_city(real_town_id) or {}
             slug = city_obj_for_group.get("slug")
             group_url = None
             if slug and group_id:
                 group_url = f"{SITE_BASE}/{slug}/group/{group_id}"
 
-            # Разметка:
+            # Все данные из API экранируем перед вставкой в HTML
+            # Разметка (строки внутри li разделены <br>):
             # строка 1 — название группы
             # строка 2 — "сайт группы" (если есть ссылка)
             # строка 3 — время / продолжительность / адрес
-            line_parts = []
-
-            # строка 1
-            line_parts.append(f"<strong>{group_name}</strong>")
+            yield "".join((
+                "    <li><strong>", escape(group_name), "</strong><br>",
+                GROUP_LINK_TEMPLATE.format(url=escape(group_url, quote=True)) if group_url else "",
+                escape(start_time),
+                f" (продолжительность {escape(duration)})" if duration else "",
+                " — ", escape(addr), "</li>\n",
+            ))
 
-            # строка 2 (опционально)
-            if group_url:
-                line_parts.append(
-                    f'<a href="{group_url}" target="_blank" '
-                    f'rel="noopener noreferrer">сайт группы</a>'
-                )
+        yield LIST_CLOSE
 
-            # строка 3
-            time_part = time
-            if duration:
-                time_part += f" (продолжительность {duration})"
-            line_parts.append(f"{time_part} — {addr}")
+    yield HTML_FOOTER
 
-            # собираем li с переносами строк
-            line = "    <li>" + "<br>".join(line_parts) + "</li>"
-            lines.append(line)
 
-        lines.append("  </ul>")
-        lines.append("")
-
-    lines.append("</section>")
-    return "\n".join(lines)
+def build_html(on_date, meetings_by_town, cities_by_id, external_sites):
+    """Весь HTML одной строкой (удобно для проверки в консоли)."""
+    return "".join(build_html_iter(on_date, meetings_by_town, cities_by_id, external_sites))
 
 
 if __name__ == "__main__":
     if CUSTOM_DATE:
         on_date = CUSTOM_DATE
     else:
-        # Берём "сейчас" в UTC и прибавляем +3 часа → текущий день по Москве
-        on_date = (datetime.utcnow() + MOSCOW_OFFSET).date().isoformat()
+        # Текущий день по Москве
+        on_date = datetime.now(MOSCOW_TZ).date().isoformat()
 
     print(f"Дата: {on_date}")
-    meetings_by_town, cities_by_id, external_sites = build_data(on_date)
-    html = build_html(on_date, meetings_by_town, cities_by_id, external_sites)
-
+    MEETINGS_CACHE = _open_meetings_cache()
+    try:
+        meetings_by_town, cities_by_id, external_sites = build_data(on_date)
+    finally:
+        SESSION.close()
+        if MEETINGS_CACHE is not None:
+            MEETINGS_CACHE.close()
+
+    # Пишем HTML потоком (буфер 1 МиБ) во временный файл рядом с итоговым
+    # и подменяем итоговый только после успешной записи — опубликованная
+    # страница никогда не остаётся записанной наполовину
     output_file = Path("na_meetings_live.html")
-    output_file.write_text(html, encoding="utf-8")
+    tmp_file = output_file.with_suffix(".html.tmp")
+    try:
+        with tmp_file.open("w", encoding="utf-8", buffering=1 << 20) as f:
+            f.writelines(
+                build_html_iter(on_date, meetings_by_town, cities_by_id, external_sites)
+            )
+        tmp_file.replace(output_file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
 
     print(f"\nГотово. Файл {output_file} создан.")